@@ -3,88 +3,164 @@
 Convert farms.uk.json to farms.geo.json for map display
 """
 
-import json
+import argparse
 import sys
 from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import orjson
+from src.utils_runtime import map_chunked
+
+# Inputs larger than this are stream-parsed instead of loaded in one go
+STREAM_THRESHOLD_BYTES = 50 * 1024 * 1024
+
+def farm_coords(farm: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """Return (lng, lat) for a farm, or None if it has no coordinates"""
+    # Flat latitude/longitude first, then the nested location format
+    lat = farm.get('latitude')
+    lng = farm.get('longitude')
+    if lat is None or lng is None:
+        loc = farm.get('location')
+        if not loc:
+            return None
+        lat = loc.get('lat')
+        lng = loc.get('lng')
+        if lat is None or lng is None:
+            return None
+    
+    # JSON numbers are usually floats already; only coerce ints and strings
+    if type(lat) is not float:
+        lat = float(lat)
+    if type(lng) is not float:
+        lng = float(lng)
+    return lng, lat
+
+def farm_to_feature(farm: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Convert a single farm to a GeoJSON feature, or None if it has no coordinates"""
+    coords = farm_coords(farm)
+    if coords is None:
+        return None
+    
+    # Nested records keep address/contact fields under these keys, flat ones at the top level
+    loc = farm['location'] if 'location' in farm else farm
+    contact = farm['contact'] if 'contact' in farm else farm
+    get = farm.get
+    
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": list(coords)
+        },
+        "properties": {
+            "id": get('id', ''),
+            "name": get('name', ''),
+            "slug": get('slug', ''),
+            "address": loc.get('address', ''),
+            "phone": contact.get('phone', ''),
+            "email": contact.get('email', ''),
+            "website": contact.get('website', ''),
+            "description": get('description', ''),
+            "hours": get('hours', {}),
+            "county": loc.get('county', ''),
+            "rating": get('rating'),
+            "user_ratings_total": get('user_ratings_total'),
+            "price_level": get('price_level'),
+            "place_id": get('place_id', ''),
+            "types": get('types', [])
+        }
+    }
+
+def iter_features(farms: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Yield a GeoJSON feature for every farm that has coordinates"""
+    for farm in farms:
+        feature = farm_to_feature(farm)
+        if feature is not None:
+            yield feature
+
+def build_features(farms: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build features for all farms, in input order, in parallel for large inputs"""
+    return map_chunked(farm_to_feature, farms)
 
 def convert_to_geojson(input_file: str, output_file: str):
     """Convert farms JSON to GeoJSON format"""
     
     # Read the farms data
-    with open(input_file, 'r', encoding='utf-8') as f:
-        farms = json.load(f)
+    farms = orjson.loads(Path(input_file).read_bytes())
     
     # Create GeoJSON structure
     geojson = {
         "type": "FeatureCollection",
-        "features": []
+        "features": build_features(farms)
     }
     
-    # Convert each farm to a GeoJSON feature
-    for farm in farms:
-        # Check for different possible location formats
-        lat = None
-        lng = None
-        
-        if 'latitude' in farm and 'longitude' in farm:
-            lat = farm['latitude']
-            lng = farm['longitude']
-        elif 'location' in farm and 'lat' in farm['location'] and 'lng' in farm['location']:
-            lat = farm['location']['lat']
-            lng = farm['location']['lng']
-        
-        if lat is not None and lng is not None:
-            feature = {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [float(lng), float(lat)]
-                },
-                "properties": {
-                    "id": farm.get('id', ''),
-                    "name": farm.get('name', ''),
-                    "slug": farm.get('slug', ''),
-                    "address": farm.get('location', {}).get('address', '') if 'location' in farm else farm.get('address', ''),
-                    "phone": farm.get('contact', {}).get('phone', '') if 'contact' in farm else farm.get('phone', ''),
-                    "email": farm.get('contact', {}).get('email', '') if 'contact' in farm else farm.get('email', ''),
-                    "website": farm.get('contact', {}).get('website', '') if 'contact' in farm else farm.get('website', ''),
-                    "description": farm.get('description', ''),
-                    "hours": farm.get('hours', {}),
-                    "county": farm.get('location', {}).get('county', '') if 'location' in farm else farm.get('county', ''),
-                    "rating": farm.get('rating'),
-                    "user_ratings_total": farm.get('user_ratings_total'),
-                    "price_level": farm.get('price_level'),
-                    "place_id": farm.get('place_id', ''),
-                    "types": farm.get('types', [])
-                }
-            }
-            geojson["features"].append(feature)
-    
     # Write the GeoJSON file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(geojson, f, indent=2, ensure_ascii=False)
+    Path(output_file).write_bytes(orjson.dumps(geojson, option=orjson.OPT_INDENT_2))
     
     print(f"✅ Converted {len(geojson['features'])} farms to GeoJSON")
     print(f"📁 Output: {output_file}")
 
+def convert_to_geojson_streaming(input_file: str, output_file: str):
+    """Convert farms JSON to GeoJSON one farm at a time, for inputs too large to load"""
+    import ijson
+    
+    count = 0
+    with open(input_file, 'rb') as f, open(output_file, 'wb') as out:
+        out.write(b'{"type":"FeatureCollection","features":[')
+        for feature in iter_features(ijson.items(f, 'item', use_float=True)):
+            if count:
+                out.write(b',')
+            out.write(orjson.dumps(feature))
+            count += 1
+        out.write(b']}')
+    
+    print(f"✅ Converted {count} farms to GeoJSON (streamed)")
+    print(f"📁 Output: {output_file}")
+
+def convert_to_ndjson(input_file: str, output_file: str, stream: bool = False):
+    """Write one GeoJSON feature per line (newline-delimited), plus a .meta file with the count"""
+    count = 0
+    with open(input_file, 'rb') as f, open(output_file, 'wb') as out:
+        if stream:
+            import ijson
+            farms = ijson.items(f, 'item', use_float=True)
+        else:
+            farms = orjson.loads(f.read())
+        for feature in iter_features(farms):
+            out.write(orjson.dumps(feature, option=orjson.OPT_APPEND_NEWLINE))
+            count += 1
+    
+    meta_file = f"{output_file}.meta"
+    Path(meta_file).write_bytes(orjson.dumps({"type": "FeatureCollection", "count": count}))
+    
+    print(f"✅ Converted {count} farms to newline-delimited GeoJSON")
+    print(f"📁 Output: {output_file} (+ {meta_file})")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert farms.uk.json to farms.geo.json')
     # Default paths
-    input_file = "../farm-frontend/public/data/farms.uk.json"
-    output_file = "../farm-frontend/public/data/farms.geo.json"
+    parser.add_argument('input_file', nargs='?', default="../farm-frontend/public/data/farms.uk.json")
+    parser.add_argument('output_file', nargs='?', default=None)
+    parser.add_argument('--stream', action='store_true', help='Stream-parse the input (automatic for files over 50 MB)')
+    parser.add_argument('--ndjson', action='store_true', help='Write one feature per line instead of a FeatureCollection')
+    args = parser.parse_args()
     
-    # Use command line arguments if provided
-    if len(sys.argv) > 1:
-        input_file = sys.argv[1]
-    if len(sys.argv) > 2:
-        output_file = sys.argv[2]
+    if args.output_file is None:
+        args.output_file = "../farm-frontend/public/data/" + ("farms.geojsonl" if args.ndjson else "farms.geo.json")
     
     # Check if input file exists
-    if not Path(input_file).exists():
-        print(f"❌ Input file not found: {input_file}")
+    input_path = Path(args.input_file)
+    if not input_path.exists():
+        print(f"❌ Input file not found: {args.input_file}")
         sys.exit(1)
     
+    stream = args.stream or input_path.stat().st_size > STREAM_THRESHOLD_BYTES
     try:
-        convert_to_geojson(input_file, output_file)
+        if args.ndjson:
+            convert_to_ndjson(args.input_file, args.output_file, stream=stream)
+        elif stream:
+            convert_to_geojson_streaming(args.input_file, args.output_file)
+        else:
+            convert_to_geojson(args.input_file, args.output_file)
     except Exception as e:
         print(f"❌ Error converting to GeoJSON: {e}")
         sys.exit(1)
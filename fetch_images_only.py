@@ -4,15 +4,27 @@ Hybrid image fetching: Google Places (real photos) + fallback to curated farm im
 This script prioritizes real farm photos from Google Places, with fallback to quality farm images.
 """
 
+import argparse
 import asyncio
-import json
+import itertools
+import logging
 import os
+import shelve
+import string
 import sys
+import unicodedata
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 import httpx
+import orjson
 import time
 import random
+from aiolimiter import AsyncLimiter
+from src.utils_io import write_bytes_atomic
+from src.utils_runtime import setup_logging
+from src.utils_http import create_client
+
+log = logging.getLogger("fetch_images")
 
 # Configuration
 GOOGLE_API_KEY = os.getenv('GOOGLE_PLACES_API_KEY')
@@ -24,26 +36,114 @@ if not GOOGLE_API_KEY:
 
 # High-quality fallback farm images (curated)
 FALLBACK_IMAGES = [
-    "https://images.unsplash.com/photo-1578662996442-48f60103fc96?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1578662996442-48f60103fc96?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1578662996442-48f60103fc96?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1578662996442-48f60103fc96?w=800&h=600&fit=crop",
-    "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?w=800&h=600&fit=crop",
     "https://images.unsplash.com/photo-1578662996442-48f60103fc96?w=800&h=600&fit=crop",
     "https://images.unsplash.com/photo-1574323347407-f5e1ad6d020b?w=800&h=600&fit=crop"
 ]
 
+# Round-robin over the fallbacks so they are evenly distributed
+_fallback_iter = itertools.cycle(FALLBACK_IMAGES)
+
+# Maximum number of farms processed concurrently
+CONCURRENCY = 16
+
+# Google Places request budget (requests per second) shared by all farms
+MAX_QPS = 10
+
+# Retry transient API errors with exponential backoff
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 503}
+
+# Frontend farms dataset this script reads and updates
+FARMS_FILE: Path = (Path(__file__).resolve().parent.parent / "farm-frontend" / "public" / "data" / "farms.uk.json")
+
+# Persistent lookup caches, reused across runs
+CACHE_DIR = Path(__file__).parent
+PLACE_CACHE_FILE = CACHE_DIR / ".place_cache"
+IMAGE_CACHE_FILE = CACHE_DIR / ".image_cache"
+ETAG_CACHE_FILE = CACHE_DIR / ".etag_cache"
+
+# Resolved image lists are re-fetched after this long
+IMAGE_CACHE_TTL_SECONDS = 48 * 3600
+
+# Maps every ASCII punctuation character to a space, in a single str.translate pass
+_PUNCT_TO_SPACE = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+
+def normalize(s: str) -> str:
+    """Normalize a string for use in cache keys (casefolded, no punctuation)"""
+    return ' '.join(unicodedata.normalize('NFKC', s).casefold().translate(_PUNCT_TO_SPACE).split())
+
 class ImageFetcher:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, refresh: bool = False):
         self.api_key = api_key
+        self.refresh = refresh
         self.base_url = "https://maps.googleapis.com/maps/api/place"
-        self.session = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
+        self.session = create_client(follow_redirects=True, headers={'User-Agent': 'farm-pipeline/1.0'})
+        self.limiter = AsyncLimiter(max_rate=MAX_QPS, time_period=1)
+        # name|address -> place_id and place_id -> (fetched_at, image URLs)
+        self.place_cache = shelve.open(str(PLACE_CACHE_FILE))
+        self.image_cache = shelve.open(str(IMAGE_CACHE_FILE))
+        # request -> (ETag, body) for conditional GETs
+        self.etag_cache = shelve.open(str(ETAG_CACHE_FILE))
+        # Lookups in progress, so duplicate farms share a single API call
+        self.inflight: Dict[str, asyncio.Task] = {}
+    
+    async def __aenter__(self) -> "ImageFetcher":
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+    
+    async def aclose(self):
+        """Close the HTTP client and flush the persistent caches"""
+        try:
+            await self.session.aclose()
+        finally:
+            self.place_cache.close()
+            self.image_cache.close()
+            self.etag_cache.close()
+    
+    async def _get(self, url: str, params: Dict[str, Any]) -> httpx.Response:
+        """Rate-limited conditional GET, backing off exponentially on 429/503 responses"""
+        # Key on the request without the API key, so rotating keys keeps the cache
+        etag_key = url + '?' + '&'.join(f"{k}={v}" for k, v in sorted(params.items()) if k != 'key')
+        cached = self.etag_cache.get(etag_key)
+        headers = {'If-None-Match': cached[0]} if cached else None
+        
+        for attempt in range(MAX_RETRIES):
+            async with self.limiter:
+                response = await self.session.get(url, params=params, headers=headers)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES - 1:
+                break
+            await asyncio.sleep(random.uniform(1, min(30, 2 ** (attempt + 1))))
+        
+        # Unchanged since the last run: replay the stored body
+        if response.status_code == 304 and cached:
+            return httpx.Response(200, content=cached[1], request=response.request)
+        
+        response.raise_for_status()
+        etag = response.headers.get('etag')
+        if etag:
+            self.etag_cache[etag_key] = (etag, response.content)
+        return response
+    
+    async def _coalesce(self, key: str, make_coro):
+        """Run make_coro() once per key; concurrent callers await the same task"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coro())
+            self.inflight[key] = task
+        return await asyncio.shield(task)
         
     async def search_place(self, shop_name: str, address: str) -> Optional[str]:
         """Search for a place using Google Places API Text Search"""
+        key = f"{normalize(shop_name)}|{normalize(address)}"
+        if not self.refresh and key in self.place_cache:
+            log.debug("    💾 Cached place for: %s", shop_name)
+            return self.place_cache[key]
+        
+        return await self._coalesce(f"search:{key}", lambda: self._search_place(shop_name, address, key))
+    
+    async def _search_place(self, shop_name: str, address: str, key: str) -> Optional[str]:
         try:
             query = f"{shop_name} {address}"
             
@@ -54,25 +154,33 @@ class ImageFetcher:
                 'type': 'establishment'
             }
             
-            response = await self.session.get(url, params=params)
-            response.raise_for_status()
+            response = await self._get(url, params)
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data['status'] == 'OK' and data['results']:
                 place = data['results'][0]
-                print(f"    ✅ Found: {place['name']}")
+                log.debug("    ✅ Found: %s", place['name'])
+                self.place_cache[key] = place['place_id']
                 return place['place_id']
             else:
-                print(f"    ❌ No place found for: {query}")
+                log.debug("    ❌ No place found for: %s", query)
                 return None
                 
         except Exception as e:
-            print(f"    ❌ Error searching for {shop_name}: {e}")
+            log.warning("    ❌ Error searching for %s: %s", shop_name, e)
             return None
     
     async def get_place_images(self, place_id: str, max_images: int = 1) -> List[str]:
         """Get image URLs for a place from Google Places API with proper redirect handling"""
+        key = f"{place_id}|{max_images}"
+        entry = None if self.refresh else self.image_cache.get(key)
+        if isinstance(entry, tuple) and time.time() - entry[0] < IMAGE_CACHE_TTL_SECONDS:
+            return entry[1]
+        
+        return await self._coalesce(f"images:{key}", lambda: self._get_place_images(place_id, max_images, key))
+    
+    async def _get_place_images(self, place_id: str, max_images: int, key: str) -> List[str]:
         try:
             url = f"{self.base_url}/details/json"
             params = {
@@ -81,16 +189,19 @@ class ImageFetcher:
                 'fields': 'photos'
             }
             
-            response = await self.session.get(url, params=params)
-            response.raise_for_status()
+            response = await self._get(url, params)
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data['status'] != 'OK' or 'photos' not in data.get('result', {}):
+                if data['status'] in ('OK', 'ZERO_RESULTS'):
+                    self.image_cache[key] = (time.time(), [])
                 return []
             
             photos = data['result']['photos']
             image_urls = []
+            # Only cache the list if every photo resolved, so failures are retried next run
+            complete = True
             
             # Limit to max_images
             photos = photos[:max_images]
@@ -104,101 +215,110 @@ class ImageFetcher:
                     # Build Google Places photo URL
                     photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo_reference}&key={self.api_key}"
                     
-                    # Follow the redirect to get the actual image URL
+                    # The photo endpoint 302s to the CDN; read the Location header instead of following it
                     try:
-                        photo_response = await self.session.head(photo_url)
-                        if photo_response.status_code == 200:
-                            # If it's a redirect, get the final URL
-                            final_url = str(photo_response.url)
-                            image_urls.append(final_url)
-                            print(f"      📸 Added real Google Places image {i+1}")
+                        async with self.limiter:
+                            photo_response = await self.session.head(photo_url, follow_redirects=False)
+                        if photo_response.is_redirect and 'location' in photo_response.headers:
+                            image_urls.append(photo_response.headers['location'])
+                            log.debug("      📸 Added real Google Places image %s", i+1)
+                        elif photo_response.status_code == 200:
+                            image_urls.append(photo_url)
+                            log.debug("      📸 Added real Google Places image %s", i+1)
                         else:
-                            print(f"      ⚠️  Photo {i+1} returned status {photo_response.status_code}")
+                            complete = False
+                            log.debug("      ⚠️  Photo %s returned status %s", i+1, photo_response.status_code)
                     except Exception as photo_error:
-                        print(f"      ⚠️  Error following redirect for photo {i+1}: {photo_error}")
+                        complete = False
+                        log.debug("      ⚠️  Error following redirect for photo %s: %s", i+1, photo_error)
                         # Fallback to original URL
                         image_urls.append(photo_url)
                     
-                    # Rate limiting between image requests
-                    await asyncio.sleep(0.5)
-                    
                 except Exception as e:
-                    print(f"      ❌ Error getting image {i+1}: {e}")
+                    complete = False
+                    log.warning("      ❌ Error getting image %s: %s", i+1, e)
                     continue
             
+            if complete:
+                self.image_cache[key] = (time.time(), image_urls)
             return image_urls
             
         except Exception as e:
-            print(f"    ❌ Error getting images for {place_id}: {e}")
+            log.warning("    ❌ Error getting images for %s: %s", place_id, e)
             return []
     
     def get_fallback_image(self, shop_name: str) -> str:
         """Get a curated fallback farm image"""
-        return random.choice(FALLBACK_IMAGES)
+        return next(_fallback_iter)
     
-    async def process_farm_images(self, farm: Dict) -> List[str]:
-        """Process a single farm to get images - Google Places first, fallback second"""
+    async def resolve_place_id(self, farm: Dict) -> Optional[str]:
+        """Find the Google Places ID for a farm (first phase)"""
         shop_name = farm.get('name', 'Unknown Farm')
-        print(f"🔍 Processing: {shop_name}")
+        log.debug("🔍 Processing: %s", shop_name)
         
-        # Try Google Places first (real photos)
         try:
             address = f"{farm['location']['address']}, {farm['location']['city']}"
             
             # Search for the place
             place_id = await self.search_place(shop_name, address)
-            if place_id:
-                # Get images from Google Places
-                images = await self.get_place_images(place_id)
-                if images:
-                    print(f"    ✅ Found {len(images)} real Google Places images")
-                    return images
-                else:
-                    print(f"    ⚠️  No Google Places images found, using fallback")
-            else:
-                print(f"    ⚠️  Place not found in Google Places, using fallback")
-                
+            if not place_id:
+                log.debug("    ⚠️  Place not found in Google Places, using fallback")
+            return place_id
+            
         except Exception as e:
-            print(f"    ⚠️  Google Places error: {e}, using fallback")
+            log.debug("    ⚠️  Google Places error: %s, using fallback", e)
+            return None
+    
+    async def fetch_images_for_place(self, place_id: str) -> List[str]:
+        """Get real photos for a resolved place (second phase)"""
+        images = await self.get_place_images(place_id)
+        if images:
+            log.debug("    ✅ Found %s real Google Places images", len(images))
+        else:
+            log.debug("    ⚠️  No Google Places images found, using fallback")
+        return images
+    
+    def images_or_fallback(self, farm: Dict, images: List[str]) -> List[str]:
+        """Google Places images if there are any, otherwise a curated fallback"""
+        if images:
+            return images
         
-        # Fallback to curated farm image
-        fallback_image = self.get_fallback_image(shop_name)
-        print(f"    📸 Using curated fallback image")
+        fallback_image = self.get_fallback_image(farm.get('name', 'Unknown Farm'))
+        log.debug("    📸 Using curated fallback image")
         return [fallback_image]
 
-async def load_existing_farms() -> List[Dict]:
+async def load_existing_farms(farms_file: Path = FARMS_FILE) -> List[Dict]:
     """Load existing farms data"""
-    farms_file = Path(__file__).parent.parent / "farm-frontend" / "public" / "data" / "farms.uk.json"
-    
     if not farms_file.exists():
         raise FileNotFoundError(f"Farms data file not found at {farms_file}")
     
-    with open(farms_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return orjson.loads(farms_file.read_bytes())
 
-async def save_farms_data(farms: List[Dict]):
+async def save_farms_data(farms: List[Dict], farms_file: Path = FARMS_FILE):
     """Save farms data back to file"""
-    farms_file = Path(__file__).parent.parent / "farm-frontend" / "public" / "data" / "farms.uk.json"
-    
-    with open(farms_file, 'w', encoding='utf-8') as f:
-        json.dump(farms, f, indent=2, ensure_ascii=False)
+    write_bytes_atomic(farms_file, orjson.dumps(farms, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
 async def main():
     """Main function to fetch images for existing farms"""
-    print("🖼️  Starting hybrid image fetch for existing farm shops...")
-    print(f"🔑 Using Google Places API + fallback images")
+    parser = argparse.ArgumentParser(description='Fetch images for existing farm shops')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached place lookups and re-query Google Places')
+    parser.add_argument('--farms-file', type=Path, default=FARMS_FILE, help=f'Farms dataset to update (default: {FARMS_FILE})')
+    parser.add_argument('--verbose', action='store_true', help='Log every lookup and photo, not just one line per farm')
+    args = parser.parse_args()
+    
+    setup_logging(args.verbose)
+    
+    log.info("🖼️  Starting hybrid image fetch for existing farm shops...")
+    log.info("🔑 Using Google Places API + fallback images")
     
     # Load existing farms
     try:
-        farms = await load_existing_farms()
-        print(f"📊 Loaded {len(farms)} existing farms")
+        farms = await load_existing_farms(args.farms_file)
+        log.info("📊 Loaded %s existing farms", len(farms))
     except Exception as e:
-        print(f"❌ Error loading farms: {e}")
+        log.error("❌ Error loading farms: %s", e)
         return
     
-    # Initialize image fetcher
-    fetcher = ImageFetcher(GOOGLE_API_KEY)
-    
     # Process farms that need images (clear existing problematic URLs)
     farms_to_process = []
     for farm in farms:
@@ -206,72 +326,91 @@ async def main():
         if farm.get('images'):
             # Check if it's a problematic URL (contains photoreference or is fallback)
             if any('photoreference' in img or 'unsplash.com' in img for img in farm['images']):
-                print(f"🔄 Clearing existing images for {farm['name']}")
+                log.debug("🔄 Clearing existing images for %s", farm['name'])
                 farm['images'] = []
         
         # Add to processing list if no images
         if not farm.get('images') or len(farm['images']) == 0:
             farms_to_process.append(farm)
     
-    print(f"📋 Found {len(farms_to_process)} farms that need images")
+    log.info("📋 Found %s farms that need images", len(farms_to_process))
     
-    # Process first 20 farms that need images
     processed_count = 0
     farms_with_images = 0
     total_images = 0
     google_places_count = 0
     fallback_count = 0
     
-    for i, farm in enumerate(farms_to_process):
-        try:
-            images = await fetcher.process_farm_images(farm)
-            if images:
-                farm['images'] = images
-                farms_with_images += 1
-                total_images += len(images)
-                
-                # Track source
-                if any('googleusercontent.com' in img for img in images):
-                    google_places_count += 1
-                    print(f"✅ Added {len(images)} real Google Places images to {farm['name']}")
-                else:
-                    fallback_count += 1
-                    print(f"✅ Added {len(images)} fallback image to {farm['name']}")
-            else:
-                farm['images'] = []
-                print(f"❌ No images found for {farm['name']}")
-            
-            processed_count += 1
-            
-            # Rate limiting between farms
-            await asyncio.sleep(1)
+    sem = asyncio.Semaphore(CONCURRENCY)
+    
+    # Initialize image fetcher; one client is shared by every farm and closed on exit
+    async with ImageFetcher(GOOGLE_API_KEY, refresh=args.refresh) as fetcher:
+        async def bounded(coro):
+            async with sem:
+                return await coro
+        
+        # Phase one: resolve every place_id concurrently
+        place_ids = await asyncio.gather(
+            *(bounded(fetcher.resolve_place_id(farm)) for farm in farms_to_process),
+            return_exceptions=True
+        )
+        place_ids = [pid if isinstance(pid, str) else None for pid in place_ids]
+        
+        # Phase two: fetch photos for every resolved place concurrently
+        image_lists = await asyncio.gather(
+            *(bounded(fetcher.fetch_images_for_place(pid)) for pid in place_ids if pid),
+            return_exceptions=True
+        )
+        
+        found_images = iter(image_lists)
+        results = []
+        for farm, place_id in zip(farms_to_process, place_ids):
+            images = next(found_images) if place_id else []
+            if isinstance(images, Exception):
+                images = []
+            results.append(fetcher.images_or_fallback(farm, images))
+    
+    for farm, images in zip(farms_to_process, results):
+        if images:
+            farm['images'] = images
+            farms_with_images += 1
+            total_images += len(images)
             
-        except Exception as e:
-            print(f"❌ Error processing {farm['name']}: {e}")
-            continue
+            # Track source
+            if any('googleusercontent.com' in img for img in images):
+                google_places_count += 1
+                log.info("✅ Added %s real Google Places images to %s", len(images), farm['name'])
+            else:
+                fallback_count += 1
+                log.info("✅ Added %s fallback image to %s", len(images), farm['name'])
+        else:
+            farm['images'] = []
+            log.info("❌ No images found for %s", farm['name'])
+        
+        processed_count += 1
     
     # Save updated data
     try:
-        await save_farms_data(farms)
-        print(f"\n✅ Successfully processed {processed_count} farms")
-        print(f"📸 {farms_with_images} farms now have images")
-        print(f"🖼️  Total images added: {total_images}")
-        print(f"🏪 Google Places images: {google_places_count}")
-        print(f"🖼️  Fallback images: {fallback_count}")
-        print("💾 Updated farms data saved")
+        await save_farms_data(farms, args.farms_file)
+        log.info("✅ Successfully processed %s farms", processed_count)
+        log.info("📸 %s farms now have images", farms_with_images)
+        log.info("🖼️  Total images added: %s", total_images)
+        log.info("🏪 Google Places images: %s", google_places_count)
+        log.info("🖼️  Fallback images: %s", fallback_count)
+        log.info("💾 Updated farms data saved")
         
         # Show statistics
         all_farms_with_images = sum(1 for farm in farms if farm.get('images'))
         all_total_images = sum(len(farm.get('images', [])) for farm in farms)
-        print(f"\n📊 Overall statistics:")
-        print(f"   Total farms: {len(farms)}")
-        print(f"   Farms with images: {all_farms_with_images}")
-        print(f"   Total images: {all_total_images}")
+        log.info("📊 Overall statistics:")
+        log.info("   Total farms: %s", len(farms))
+        log.info("   Farms with images: %s", all_farms_with_images)
+        log.info("   Total images: %s", all_total_images)
         if all_farms_with_images > 0:
-            print(f"   Average images per shop: {all_total_images/all_farms_with_images:.1f}")
+            log.info("   Average images per shop: %.1f", all_total_images/all_farms_with_images)
         
     except Exception as e:
-        print(f"❌ Error saving farms data: {e}")
+        log.error("❌ Error saving farms data: %s", e)
 
 if __name__ == "__main__":
     asyncio.run(main())
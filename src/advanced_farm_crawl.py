@@ -3,17 +3,20 @@ Advanced farm shop crawling with Crawl4AI.
 Uses LLM extraction to get structured farm shop data.
 """
 import asyncio
+import hashlib
 import json
+import os
+import re
 from pathlib import Path
 from typing import Dict, Any, List
 
+import httpx
 from crawl4ai import (
     AsyncWebCrawler, 
     BrowserConfig, 
-    CrawlerRunConfig,
-    LLMConfig,
-    LLMExtractionStrategy
+    CrawlerRunConfig
 )
+from utils_runtime import run
 
 # Farm shop schema for LLM extraction
 FARM_SHOP_SCHEMA = {
@@ -80,140 +83,62 @@ TEST_URLS = [
     "https://www.abelandcole.co.uk/"
 ]
 
-async def extract_farm_shop_data(url: str, name: str) -> Dict[str, Any]:
-    """Extract structured farm shop data using LLM."""
-    print(f"🌾 Extracting data from {name}...")
-    
-    # Browser configuration
-    browser_config = BrowserConfig(
-        headless=True,
-        browser_type="chromium",
-        viewport_width=1920,
-        viewport_height=1080,
-        user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    )
-    
-    # LLM configuration (you can use any LLM provider)
-    llm_config = LLMConfig(
-        provider="openai",  # or "anthropic", "ollama", etc.
-        model="gpt-4o-mini",  # or "claude-3-haiku", "llama3.1:8b", etc.
-        api_key="your-api-key-here"  # Set your API key
-    )
-    
-    # Extraction strategy
-    extraction_strategy = LLMExtractionStrategy(
-        llm_config=llm_config,
-        schema=FARM_SHOP_SCHEMA,
-        extraction_prompt="""
-        Extract farm shop information from this webpage. Focus on:
-        - Business name and description
-        - Physical address and contact details
-        - Opening hours if available
-        - Types of products sold
-        - Services offered (farm shop, cafe, etc.)
-        - Whether they're organic certified
-        
-        Be accurate and only extract information that's clearly stated on the page.
-        """
-    )
+# LLM used to extract structured data from all crawled pages in one request
+LLM_MODEL = "gpt-4o-mini"
+LLM_API_URL = "https://api.openai.com/v1/chat/completions"
+
+# Markdown sent to the LLM per page; keeps the batched prompt within context limits
+MAX_MARKDOWN_CHARS = 8000
+
+# LLM extractions keyed by a hash of the page content, so unchanged pages are never re-extracted
+LLM_CACHE_DIR = Path("dist") / ".llm_cache"
+
+EXTRACTION_PROMPT = """
+Extract farm shop information from each webpage below. Focus on:
+- Business name and description
+- Physical address and contact details
+- Opening hours if available
+- Types of products sold
+- Services offered (farm shop, cafe, etc.)
+- Whether they're organic certified
+
+Be accurate and only extract information that's clearly stated on the page.
+Return a JSON object {"shops": [...]} where element i follows this JSON schema
+and describes PAGE i:
+"""
+
+# Keywords behind the basic extraction flags, matched in one case-insensitive pass
+HEURISTIC_RE = re.compile(r"organic|cafe|coffee|shop|store|farm", re.IGNORECASE)
+
+async def crawl_page(crawler: AsyncWebCrawler, url: str, name: str) -> Dict[str, Any]:
+    """Crawl a page and return its metadata and markdown, without any extraction."""
+    print(f"🌾 Crawling {name}...")
     
-    # Crawler configuration
+    # Images and screenshots are not needed for markdown extraction, so skip them
     run_config = CrawlerRunConfig(
-        wait_for_images=True,
         wait_for_js=True,
-        screenshot=True,
         extract_links=True,
-        extract_metadata=True,
-        extraction_strategy=extraction_strategy
+        extract_metadata=True
     )
     
     try:
-        async with AsyncWebCrawler(config=browser_config) as crawler:
-            result = await crawler.arun(
-                url=url,
-                config=run_config
-            )
-            
-            # Get extracted data
-            extracted_data = result.extracted_content if result.extracted_content else {}
-            
-            # Combine with metadata
-            data = {
-                "name": name,
-                "url": url,
-                "title": result.metadata.get("title", ""),
-                "description": result.metadata.get("description", ""),
-                "markdown_length": len(result.markdown),
-                "links_count": len(result.links) if result.links else 0,
-                "screenshot": result.screenshot is not None,
-                "extracted_data": extracted_data,
-                "status": "success"
-            }
-            
-            print(f"✅ {name}: Extracted {len(extracted_data)} fields")
-            return data
-            
-    except Exception as e:
-        print(f"❌ {name}: Error - {e}")
+        result = await crawler.arun(
+            url=url,
+            config=run_config
+        )
+        
+        markdown = str(result.markdown or "")
         return {
             "name": name,
             "url": url,
-            "status": "error",
-            "error": str(e)
+            "title": result.metadata.get("title", ""),
+            "description": result.metadata.get("description", ""),
+            "markdown_length": len(markdown),
+            "links_count": len(result.links) if result.links else 0,
+            "markdown": markdown,
+            "status": "success"
         }
-
-async def crawl_without_llm(url: str, name: str) -> Dict[str, Any]:
-    """Fallback: Crawl without LLM extraction."""
-    print(f"🌾 Crawling {name} (basic extraction)...")
-    
-    browser_config = BrowserConfig(
-        headless=True,
-        browser_type="chromium",
-        viewport_width=1920,
-        viewport_height=1080
-    )
-    
-    run_config = CrawlerRunConfig(
-        wait_for_images=True,
-        wait_for_js=True,
-        screenshot=True,
-        extract_links=True,
-        extract_metadata=True
-    )
-    
-    try:
-        async with AsyncWebCrawler(config=browser_config) as crawler:
-            result = await crawler.arun(
-                url=url,
-                config=run_config
-            )
-            
-            # Basic data extraction from markdown
-            markdown = result.markdown.lower()
-            
-            # Simple heuristics for data extraction
-            data = {
-                "name": name,
-                "url": url,
-                "title": result.metadata.get("title", ""),
-                "description": result.metadata.get("description", ""),
-                "markdown_length": len(result.markdown),
-                "links_count": len(result.links) if result.links else 0,
-                "screenshot": result.screenshot is not None,
-                "extracted_data": {
-                    "name": result.metadata.get("title", name),
-                    "description": result.metadata.get("description", ""),
-                    "has_organic": "organic" in markdown,
-                    "has_cafe": "cafe" in markdown or "coffee" in markdown,
-                    "has_shop": "shop" in markdown or "store" in markdown,
-                    "has_farm": "farm" in markdown
-                },
-                "status": "success"
-            }
-            
-            print(f"✅ {name}: Basic extraction complete")
-            return data
-            
+        
     except Exception as e:
         print(f"❌ {name}: Error - {e}")
         return {
@@ -223,32 +148,134 @@ async def crawl_without_llm(url: str, name: str) -> Dict[str, Any]:
             "error": str(e)
         }
 
+def extract_basic_data(page: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract basic farm shop data from a crawled page with simple heuristics."""
+    found = {match.lower() for match in HEURISTIC_RE.findall(page["markdown"])}
+    
+    return {
+        "name": page["title"] or page["name"],
+        "description": page["description"],
+        "has_organic": "organic" in found,
+        "has_cafe": "cafe" in found or "coffee" in found,
+        "has_shop": "shop" in found or "store" in found,
+        "has_farm": "farm" in found
+    }
+
+def llm_cache_file(page: Dict[str, Any]) -> Path:
+    """Cache file for a page's extraction, keyed on everything sent to the LLM."""
+    digest = hashlib.sha256()
+    schema = json.dumps(FARM_SHOP_SCHEMA, sort_keys=True)
+    for part in (LLM_MODEL, EXTRACTION_PROMPT, schema, page["markdown"][:MAX_MARKDOWN_CHARS]):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return LLM_CACHE_DIR / f"{digest.hexdigest()}.json"
+
+async def extract_with_llm(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Extract structured data for several pages with a single LLM request."""
+    page_sections = [
+        f"---PAGE {i}---\n{page['markdown'][:MAX_MARKDOWN_CHARS]}"
+        for i, page in enumerate(pages)
+    ]
+    prompt = EXTRACTION_PROMPT + json.dumps(FARM_SHOP_SCHEMA) + "\n\n" + "\n".join(page_sections)
+    
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        response = await client.post(
+            LLM_API_URL,
+            headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"},
+            json={
+                "model": LLM_MODEL,
+                "response_format": {"type": "json_object"},
+                "messages": [{"role": "user", "content": prompt}]
+            }
+        )
+        response.raise_for_status()
+    
+    content = response.json()["choices"][0]["message"]["content"]
+    shops = json.loads(content).get("shops", [])
+    if len(shops) != len(pages):
+        raise ValueError(f"expected {len(pages)} shops, got {len(shops)}")
+    return shops
+
+async def extract_farm_shop_data(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Extract structured farm shop data from crawled pages using one LLM call."""
+    results = []
+    candidates = []
+    
+    # Cheap heuristics first: only pages that look like farm shops go to the LLM
+    for page in pages:
+        if page["status"] != "success":
+            results.append(page)
+            continue
+        page["extracted_data"] = extract_basic_data(page)
+        if page["extracted_data"]["has_farm"] or page["extracted_data"]["has_shop"]:
+            candidates.append(page)
+        results.append(page)
+    
+    # Pages whose content is unchanged since a previous run reuse the cached extraction
+    LLM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    uncached = []
+    for page in candidates:
+        cache_file = llm_cache_file(page)
+        if cache_file.exists():
+            page["extracted_data"] = json.loads(cache_file.read_text(encoding="utf-8"))
+            print(f"💾 {page['name']}: Using cached extraction")
+        else:
+            uncached.append((page, cache_file))
+    
+    if uncached:
+        print(f"🤖 Extracting {len(uncached)} pages with one LLM request...")
+        try:
+            shops = await extract_with_llm([page for page, _ in uncached])
+            for (page, cache_file), shop in zip(uncached, shops):
+                page["extracted_data"] = shop
+                cache_file.write_text(json.dumps(shop, ensure_ascii=False), encoding="utf-8")
+                print(f"✅ {page['name']}: Extracted {len(shop)} fields")
+        except Exception as e:
+            print(f"❌ LLM extraction failed, keeping basic extraction - {e}")
+    
+    for page in results:
+        page.pop("markdown", None)
+    return results
+
+async def crawl_without_llm(crawler: AsyncWebCrawler, url: str, name: str) -> Dict[str, Any]:
+    """Fallback: Crawl without LLM extraction."""
+    page = await crawl_page(crawler, url, name)
+    
+    if page["status"] == "success":
+        page["extracted_data"] = extract_basic_data(page)
+        del page["markdown"]
+        print(f"✅ {name}: Basic extraction complete")
+    return page
+
 async def main():
     """Main function to crawl farm shops with structured extraction."""
     print("🚀 Starting advanced farm shop crawl...")
     print(f"📋 Testing {len(TEST_URLS)} farm shop websites")
     print("-" * 50)
     
-    results = []
+    use_llm = bool(os.getenv("OPENAI_API_KEY"))
+    if not use_llm:
+        print("⚠️  No LLM API key found, using basic extraction")
     
-    # Try LLM extraction first, fallback to basic crawling
-    for url in TEST_URLS:
-        name = url.split("//")[1].split("/")[0].replace("www.", "")
-        
-        # Check if LLM API key is available
-        try:
-            # You can set this via environment variable
-            import os
-            if os.getenv("OPENAI_API_KEY"):
-                result = await extract_farm_shop_data(url, name)
-            else:
-                print("⚠️  No LLM API key found, using basic extraction")
-                result = await crawl_without_llm(url, name)
-        except:
-            result = await crawl_without_llm(url, name)
-        
-        results.append(result)
-        await asyncio.sleep(2)  # Rate limiting
+    # One browser serves every page; pages are crawled concurrently in their own tabs
+    browser_config = BrowserConfig(
+        headless=True,
+        browser_type="chromium",
+        viewport_width=1920,
+        viewport_height=1080,
+        user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    )
+    crawl = crawl_page if use_llm else crawl_without_llm
+    
+    # Crawl every page first; LLM extraction is batched into one request afterwards
+    async with AsyncWebCrawler(config=browser_config) as crawler:
+        results = await asyncio.gather(*(
+            crawl(crawler, url, url.split("//")[1].split("/")[0].replace("www.", ""))
+            for url in TEST_URLS
+        ))
+    
+    if use_llm:
+        results = await extract_farm_shop_data(results)
     
     # Save results
     output_file = Path("advanced_crawl_results.json")
@@ -272,4 +299,4 @@ async def main():
             print(f"  {key}: {value}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
@@ -7,45 +7,54 @@ import os
 import re
 from typing import Dict, Any, List, Optional
 
+# Offerings implied by Google Places business types
+TYPE_OFFERINGS = {
+    'food': 'fresh produce',
+    'store': 'farm shop',
+    'restaurant': 'café',
+    'bakery': 'bakery',
+    'grocery_or_supermarket': 'grocery',
+}
+
+# Offerings implied by keywords in the place name
+KEYWORD_OFFERINGS = {
+    'organic': 'organic produce',
+    'dairy': 'dairy products',
+    'milk': 'dairy products',
+    'meat': 'meat',
+    'butcher': 'meat',
+    'eggs': 'eggs',
+    'poultry': 'eggs',
+    'honey': 'honey',
+    'jam': 'preserves',
+    'preserves': 'preserves',
+}
+KEYWORD_RE = re.compile('|'.join(KEYWORD_OFFERINGS))
+
 def extract_offerings_from_place_data(place_data: Dict[str, Any]) -> List[str]:
     """Extract offerings from Google Places data."""
-    offerings = []
+    offerings = {}
     
     # Check business types
     types = place_data.get('types', [])
-    if 'food' in types:
-        offerings.append('fresh produce')
-    if 'store' in types:
-        offerings.append('farm shop')
-    if 'restaurant' in types:
-        offerings.append('café')
-    if 'bakery' in types:
-        offerings.append('bakery')
-    if 'grocery_or_supermarket' in types:
-        offerings.append('grocery')
-    
-    # Check for specific keywords in name or types
+    for place_type in types:
+        if place_type in TYPE_OFFERINGS:
+            offerings[TYPE_OFFERINGS[place_type]] = None
+    
+    # Check for specific keywords in name (and organic in types)
     name = place_data.get('name', '').lower()
-    if 'organic' in name or 'organic' in str(types):
-        offerings.append('organic produce')
-    if 'dairy' in name or 'milk' in name:
-        offerings.append('dairy products')
-    if 'meat' in name or 'butcher' in name:
-        offerings.append('meat')
-    if 'eggs' in name or 'poultry' in name:
-        offerings.append('eggs')
-    if 'honey' in name:
-        offerings.append('honey')
-    if 'jam' in name or 'preserves' in name:
-        offerings.append('preserves')
+    for keyword in KEYWORD_RE.findall(name):
+        offerings[KEYWORD_OFFERINGS[keyword]] = None
+    if any('organic' in place_type for place_type in types):
+        offerings['organic produce'] = None
     
     # Default offerings if none found
     if not offerings:
-        offerings = ['farm shop', 'fresh produce']
+        return ['farm shop', 'fresh produce']
     
-    return list(set(offerings))  # Remove duplicates
+    return list(offerings)
 
-def generate_description(place_data: Dict[str, Any]) -> str:
+def generate_description(place_data: Dict[str, Any], offerings: Optional[List[str]] = None) -> str:
     """Generate a rich description for a farm shop."""
     name = place_data.get('name', 'This farm shop')
     address_info = place_data.get('formatted_address', '')
@@ -62,8 +71,9 @@ def generate_description(place_data: Dict[str, Any]) -> str:
             city = parts[-2] if parts[-2] and not parts[-2].isdigit() else ''
             county = parts[-3] if len(parts) >= 3 and not parts[-3].isdigit() else ''
     
-    # Generate offerings
-    offerings = extract_offerings_from_place_data(place_data)
+    # Generate offerings unless the caller already has them
+    if offerings is None:
+        offerings = extract_offerings_from_place_data(place_data)
     
     # Build description
     description_parts = []
@@ -108,15 +118,12 @@ def generate_description(place_data: Dict[str, Any]) -> str:
 
 def enhance_place_data_with_description(place_data: Dict[str, Any]) -> Dict[str, Any]:
     """Enhance place data with generated description and offerings."""
-    # Generate description
-    description = generate_description(place_data)
-    
-    # Extract offerings
+    # Extract offerings once and reuse them for the description
     offerings = extract_offerings_from_place_data(place_data)
+    description = generate_description(place_data, offerings)
     
-    # Add to place data
-    enhanced_data = place_data.copy()
-    enhanced_data['generated_description'] = description
-    enhanced_data['extracted_offerings'] = offerings
+    # Add to place data in place; callers use the returned dict as the place
+    place_data['generated_description'] = description
+    place_data['extracted_offerings'] = offerings
     
-    return enhanced_data
+    return place_data
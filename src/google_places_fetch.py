@@ -5,16 +5,26 @@ Searches major UK cities and regions systematically.
 """
 
 import asyncio
-import json
+import contextlib
 import os
+import random
+import shelve
 import sys
+import time
 import argparse
+import logging
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Set, Tuple
 import httpx
+import orjson
+from aiolimiter import AsyncLimiter
 from models import FarmShop, Location, Contact
 from utils_geo import slugify, haversine_km
 from description_generator import enhance_place_data_with_description
+from utils_runtime import map_chunked, run, setup_logging
+from utils_http import create_client
+
+log = logging.getLogger("google_places")
 
 # Configuration
 GOOGLE_API_KEY = os.getenv('GOOGLE_PLACES_API_KEY')
@@ -22,6 +32,64 @@ if not GOOGLE_API_KEY:
     print("❌ GOOGLE_PLACES_API_KEY environment variable required")
     sys.exit(1)
 
+# Maximum number of Google Places requests in flight while searching
+SEARCH_CONCURRENCY = 20
+
+# Maximum number of farms processed concurrently in --images-only mode
+IMAGE_CONCURRENCY = 16
+
+# Requests per second across all Google Places calls, kept under the 100 QPS quota
+MAX_QPS = 90
+rate_limiter = AsyncLimiter(max_rate=MAX_QPS, time_period=1)
+
+# Transient failures are retried with exponential backoff and jitter
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Radius of each search circle
+SEARCH_RADIUS_M = 50000
+
+# Places and finished search locations are appended here as they complete, so an
+# interrupted run can resume without paying for the same API calls again
+CHECKPOINT_FILE = Path("dist") / "farms.jsonl"
+
+# Places with the same name closer than this are duplicate listings of one shop
+DUPLICATE_DISTANCE_KM = 0.05
+
+# Search results and place details are reused across runs for this long
+PLACES_CACHE_FILE = Path("dist") / ".places_cache"
+CACHE_TTL_SECONDS = 48 * 3600
+
+# Places API (New) text search; one request returns a page of up to 20 places
+PLACES_SEARCH_URL = "https://places.googleapis.com/v1/places:searchText"
+
+# Everything main() needs from a place, so no per-place details request is required
+SEARCH_FIELD_MASK = ",".join([
+    "places.id",
+    "places.displayName",
+    "places.formattedAddress",
+    "places.addressComponents",
+    "places.location",
+    "places.types",
+    "places.internationalPhoneNumber",
+    "places.websiteUri",
+    "places.googleMapsUri",
+    "places.rating",
+    "places.userRatingCount",
+    "places.priceLevel",
+    "places.photos",
+    "nextPageToken",
+])
+
+# Places API (New) price levels mapped to the legacy 0-4 scale
+PRICE_LEVELS = {
+    "PRICE_LEVEL_FREE": 0,
+    "PRICE_LEVEL_INEXPENSIVE": 1,
+    "PRICE_LEVEL_MODERATE": 2,
+    "PRICE_LEVEL_EXPENSIVE": 3,
+    "PRICE_LEVEL_VERY_EXPENSIVE": 4,
+}
+
 # Major UK cities/regions to search
 UK_LOCATIONS = [
     # England - Major cities
@@ -87,50 +155,194 @@ UK_LOCATIONS = [
     {"name": "West Yorkshire", "lat": 53.8000, "lng": -1.5491},
 ]
 
-async def search_places_nearby(client: httpx.AsyncClient, lat: float, lng: float, radius: int = 50000) -> List[Dict[str, Any]]:
-    """Search for farm shops near a location."""
-    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-    params = {
-        "location": f"{lat},{lng}",
-        "radius": radius,
-        "keyword": "farm shop",
-        "type": "food",
-        "key": GOOGLE_API_KEY
+def spread_search_locations(locations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop search locations whose search circle is fully covered by an earlier kept one.
+
+    Every circle has the same SEARCH_RADIUS_M, so that only happens for a repeated centre.
+    Partly overlapping circles are all kept: the uncovered part would otherwise go unsearched,
+    and each search is capped at 60 results, so merging dense areas would lose places.
+    """
+    kept = []
+    for location in locations:
+        if all(haversine_km(location['lat'], location['lng'], other['lat'], other['lng']) > 0 for other in kept):
+            kept.append(location)
+    return kept
+
+def dedupe_nearby_places(places: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop places listed under another place_id with the same name within DUPLICATE_DISTANCE_KM."""
+    seen_by_name: Dict[str, List[Tuple[float, float]]] = {}
+    result = []
+    for place in places:
+        coords = (place.get('geometry') or {}).get('location') or {}
+        lat, lng = coords.get('lat', 0), coords.get('lng', 0)
+        # Only listings with the same name are compared, so each check is against a handful of places
+        same_name = seen_by_name.setdefault(place.get('name', '').lower(), [])
+        if any(haversine_km(lat, lng, other_lat, other_lng) < DUPLICATE_DISTANCE_KM for other_lat, other_lng in same_name):
+            continue
+        same_name.append((lat, lng))
+        result.append(place)
+    return result
+
+def load_checkpoint(path: Path) -> Tuple[List[Dict[str, Any]], Set[str]]:
+    """Load places and completed search locations from an interrupted run."""
+    places = []
+    completed_locations = set()
+    if not path.exists():
+        return places, completed_locations
+    
+    with open(path, "r+b") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Drop a last line cut off by an interrupted write
+                f.truncate(f.tell() - len(line))
+                break
+            record = orjson.loads(line)
+            if "completed_location" in record:
+                completed_locations.add(record["completed_location"])
+            else:
+                places.append(record)
+    
+    return places, completed_locations
+
+def cache_get(cache: Optional[shelve.Shelf], key: str) -> Optional[Any]:
+    """Return a cached value if it is younger than CACHE_TTL_SECONDS."""
+    if cache is None:
+        return None
+    entry = cache.get(key)
+    if entry and time.time() - entry[0] < CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+def cache_put(cache: Optional[shelve.Shelf], key: str, value: Any) -> None:
+    """Store a value in the cache with the current time."""
+    if cache is not None:
+        cache[key] = (time.time(), value)
+
+def open_places_cache(use_cache: bool = True):
+    """Open the on-disk Places cache, or a context yielding None when caching is disabled."""
+    if not use_cache:
+        return contextlib.nullcontext(None)
+    PLACES_CACHE_FILE.parent.mkdir(exist_ok=True)
+    return shelve.open(str(PLACES_CACHE_FILE))
+
+async def request_with_retry(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+    """Rate-limited request, retried on transient HTTP statuses and connection errors."""
+    for attempt in range(MAX_RETRIES):
+        last_attempt = attempt == MAX_RETRIES - 1
+        delay = random.uniform(1, min(30, 2 ** (attempt + 1)))
+        try:
+            async with rate_limiter:
+                response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if last_attempt:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+            # Honour the server's Retry-After (in seconds) when it sends one
+            retry_after = response.headers.get("retry-after", "")
+            if retry_after.isdigit():
+                delay = min(int(retry_after), 60)
+        await asyncio.sleep(delay)
+
+async def search_places_nearby(client: httpx.AsyncClient, lat: float, lng: float, radius: int = SEARCH_RADIUS_M,
+                               cache: Optional[shelve.Shelf] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """Search for farm shops near a location, with place details included in each result.
+
+    Returns the results and whether every page was fetched.
+    """
+    # ~100m precision, so nearby search centres share a cache entry
+    cache_key = f"search:{lat:.3f},{lng:.3f},{radius}"
+    cached = cache_get(cache, cache_key)
+    if cached is not None:
+        return cached, True
+    
+    headers = {
+        "X-Goog-Api-Key": GOOGLE_API_KEY,
+        "X-Goog-FieldMask": SEARCH_FIELD_MASK
+    }
+    body = {
+        "textQuery": "farm shop",
+        "locationBias": {
+            "circle": {
+                "center": {"latitude": lat, "longitude": lng},
+                "radius": float(radius)
+            }
+        },
+        "pageSize": 20
     }
     
     all_results = []
-    page_token = None
     
     while True:
-        if page_token:
-            params["pagetoken"] = page_token
-        
         try:
-            response = await client.get(url, params=params)
+            response = await request_with_retry(client, "POST", PLACES_SEARCH_URL, json=body, headers=headers)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
-            if data["status"] == "OK":
-                all_results.extend(data["results"])
-                page_token = data.get("next_page_token")
-                
-                if not page_token:
-                    break
-                    
-                # Wait before requesting next page
-                await asyncio.sleep(2)
-            else:
-                print(f"⚠️  API Error: {data['status']} - {data.get('error_message', 'Unknown error')}")
-                break
+            for place in data.get("places", []):
+                place = place_from_v1(place)
+                place_lat = place["geometry"]["location"]["lat"]
+                place_lng = place["geometry"]["location"]["lng"]
+                # locationBias only ranks results, so keep the old nearby-search radius
+                if haversine_km(lat, lng, place_lat, place_lng) <= radius / 1000:
+                    all_results.append(place)
+            
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                # Only complete result sets are cached
+                cache_put(cache, cache_key, all_results)
+                return all_results, True
+            body["pageToken"] = page_token
                 
+        except httpx.HTTPStatusError as e:
+            log.warning("⚠️  API Error: %s - %s", e.response.status_code, e.response.text)
+            return all_results, False
         except Exception as e:
-            print(f"❌ Error fetching places: {e}")
-            break
+            log.warning("❌ Error fetching places: %s", e)
+            return all_results, False
+
+def place_from_v1(place: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a Places API (New) result into the legacy Places API shape."""
+    location = place.get("location", {})
+    result = {
+        "place_id": place.get("id"),
+        "name": place.get("displayName", {}).get("text", ""),
+        "formatted_address": place.get("formattedAddress", ""),
+        "address_components": [
+            {
+                "long_name": component.get("longText", ""),
+                "short_name": component.get("shortText", ""),
+                "types": component.get("types", [])
+            }
+            for component in place.get("addressComponents", [])
+        ],
+        "geometry": {"location": {"lat": location.get("latitude", 0), "lng": location.get("longitude", 0)}},
+        "types": place.get("types", []),
+        "photos": place.get("photos", [])
+    }
+    
+    # Optional fields are left out when missing, as the legacy API did
+    optional = {
+        "international_phone_number": place.get("internationalPhoneNumber"),
+        "website": place.get("websiteUri"),
+        "url": place.get("googleMapsUri"),
+        "rating": place.get("rating"),
+        "user_ratings_total": place.get("userRatingCount"),
+        "price_level": PRICE_LEVELS.get(place.get("priceLevel"))
+    }
+    result.update((key, value) for key, value in optional.items() if value is not None)
     
-    return all_results
+    return result
 
-async def get_place_details(client: httpx.AsyncClient, place_id: str) -> Optional[Dict[str, Any]]:
+async def get_place_details(client: httpx.AsyncClient, place_id: str,
+                            cache: Optional[shelve.Shelf] = None) -> Optional[Dict[str, Any]]:
     """Get detailed information for a place."""
+    cache_key = f"details:{place_id}"
+    cached = cache_get(cache, cache_key)
+    if cached is not None:
+        return cached
+    
     url = "https://maps.googleapis.com/maps/api/place/details/json"
     params = {
         "place_id": place_id,
@@ -139,47 +351,45 @@ async def get_place_details(client: httpx.AsyncClient, place_id: str) -> Optiona
     }
     
     try:
-        response = await client.get(url, params=params)
+        response = await request_with_retry(client, "GET", url, params=params)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
         if data["status"] == "OK":
+            cache_put(cache, cache_key, data["result"])
             return data["result"]
         else:
-            print(f"⚠️  Details API Error: {data['status']} for {place_id}")
+            log.warning("⚠️  Details API Error: %s for %s", data['status'], place_id)
             return None
             
     except Exception as e:
-        print(f"❌ Error fetching details for {place_id}: {e}")
+        log.warning("❌ Error fetching details for %s: %s", place_id, e)
         return None
 
-async def get_place_images(client: httpx.AsyncClient, place_id: str, photos: List[Dict], max_images: int = 1) -> List[str]:
-    """Get image URLs for a place."""
-    image_urls = []
-    
-    for i, photo in enumerate(photos[:max_images]):
-        try:
-            # Get the photo reference
-            photo_ref = photo.get("photo_reference")
-            if not photo_ref:
-                continue
-            
-            # Construct the image URL
-            image_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo_ref}&key={GOOGLE_API_KEY}"
-            
-            # Verify the image URL is accessible
-            async with httpx.AsyncClient(follow_redirects=True) as img_client:
-                head_response = await img_client.head(image_url)
-                if head_response.status_code == 200:
-                    image_urls.append(image_url)
-                else:
-                    print(f"⚠️  Image not accessible for {place_id}")
-                    
-        except Exception as e:
-            print(f"❌ Error processing image for {place_id}: {e}")
-            continue
-    
-    return image_urls
+def photo_url(photo: Dict[str, Any]) -> Optional[str]:
+    """Build the image URL from the photo resource name (new API) or reference (legacy API)."""
+    photo_name = photo.get("name")
+    photo_ref = photo.get("photo_reference")
+    if photo_name:
+        return f"https://places.googleapis.com/v1/{photo_name}/media?maxWidthPx=800&key={GOOGLE_API_KEY}"
+    if photo_ref:
+        return f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo_ref}&key={GOOGLE_API_KEY}"
+    return None
+
+def get_place_images(photos: List[Dict], max_images: int = 1) -> List[str]:
+    """Get image URLs for a place; they are built from the photo data without any request."""
+    return [url for url in map(photo_url, photos[:max_images]) if url]
+
+# Address component type -> (priority, field) for parse_address_components
+ADDRESS_COMPONENT_FIELDS = {
+    "street_number": (0, "address"),
+    "route": (0, "address"),
+    "locality": (1, "city"),
+    "sublocality": (1, "city"),
+    "administrative_area_level_1": (2, "county"),
+    "postal_code": (3, "postcode"),
+    "country": (4, "country"),
+}
 
 def parse_address_components(address_components: List[Dict], formatted_address: str) -> Dict[str, str]:
     """Parse address components into structured format."""
@@ -190,25 +400,22 @@ def parse_address_components(address_components: List[Dict], formatted_address:
         "postcode": "",
         "country": ""
     }
+    address_parts = []
     
     for component in address_components:
-        types = component.get("types", [])
+        # A component can have several types; the highest-priority mapped one decides the field
+        matches = [ADDRESS_COMPONENT_FIELDS[t] for t in component.get("types", []) if t in ADDRESS_COMPONENT_FIELDS]
+        if not matches:
+            continue
+        _, field = min(matches)
         long_name = component.get("long_name", "")
-        short_name = component.get("short_name", "")
         
-        if "street_number" in types or "route" in types:
-            if result["address"]:
-                result["address"] += ", " + long_name
-            else:
-                result["address"] = long_name
-        elif "locality" in types or "sublocality" in types:
-            result["city"] = long_name
-        elif "administrative_area_level_1" in types:
-            result["county"] = long_name
-        elif "postal_code" in types:
-            result["postcode"] = long_name
-        elif "country" in types:
-            result["country"] = long_name
+        if field == "address":
+            address_parts.append(long_name)
+        else:
+            result[field] = long_name
+    
+    result["address"] = ", ".join(address_parts)
     
     # Fallback: if no structured address, use formatted address
     if not result["address"]:
@@ -238,6 +445,60 @@ def parse_address(address: str) -> Dict[str, str]:
     
     return {"address": address, "city": "", "county": "", "postcode": ""}
 
+def build_farm_shop(place: Dict[str, Any]) -> Optional[FarmShop]:
+    """Convert an enriched place into a FarmShop, or None if it is invalid."""
+    try:
+        name = place.get('name', 'Unknown Farm Shop')
+        
+        # Use address components if available, otherwise fallback to formatted address
+        if place.get('address_components'):
+            address_info = parse_address_components(place.get('address_components', []), place.get('formatted_address', ''))
+        else:
+            address_info = parse_address(place.get('formatted_address', ''))
+        
+        # Create location object
+        coords = (place.get('geometry') or {}).get('location') or {}
+        location = Location(
+            lat=coords.get('lat', 0),
+            lng=coords.get('lng', 0),
+            address=address_info.get('address', ''),
+            city=address_info.get('city', ''),
+            county=address_info.get('county', ''),
+            postcode=address_info.get('postcode', '')
+        )
+        
+        # Create contact object
+        contact = Contact(
+            phone=place.get('international_phone_number', ''),
+            email=None,  # Google Places doesn't provide email
+            website=place.get('website', '')
+        )
+        
+        # Create farm shop object
+        slug = slugify(name)
+        return FarmShop(
+            id=f"farm_{slug}",
+            name=name,
+            slug=slug,
+            location=location,
+            contact=contact,
+            offerings=place.get('offerings', []),
+            images=place.get('images', []),
+            rating=place.get('rating'),
+            user_ratings_total=place.get('user_ratings_total'),
+            price_level=place.get('price_level'),
+            place_id=place.get('place_id'),
+            types=place.get('types', [])
+        )
+        
+    except Exception as e:
+        log.warning("❌ Error processing %s: %s", place.get('name', 'Unknown'), e)
+        return None
+
+def build_farm_shops(places: List[Dict[str, Any]]) -> List[FarmShop]:
+    """Convert places into FarmShops, across processes for large inputs."""
+    return map_chunked(build_farm_shop, places)
+
 async def main():
     """Main function to fetch all UK farm shops."""
     # Parse command line arguments
@@ -245,121 +506,94 @@ async def main():
     parser.add_argument('--no-images', action='store_true', help='Skip fetching images to save API calls')
     parser.add_argument('--images-only', action='store_true', help='Only fetch images for existing farms (requires farms.uk.json)')
     parser.add_argument('--max-images', type=int, default=1, help='Maximum number of images per farm (default: 1)')
+    parser.add_argument('--verbose', action='store_true', help='Log every search, farm and photo, not just the summary')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not update the on-disk Places cache')
     args = parser.parse_args()
     
+    setup_logging(args.verbose)
+    
     if args.images_only:
-        await fetch_images_only(args.max_images)
+        await fetch_images_only(args.max_images, use_cache=not args.no_cache)
         return
     
-    print("🔍 Starting Google Places farm shop search...")
+    log.info("🔍 Starting Google Places farm shop search...")
     if args.no_images:
-        print("📸 Image fetching disabled - will save API calls")
+        log.info("📸 Image fetching disabled - will save API calls")
     
-    all_places = []
-    seen_place_ids = set()
+    output_dir = Path("dist")
+    output_dir.mkdir(exist_ok=True)
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for location in UK_LOCATIONS:
-            print(f"📍 Searching near {location['name']}...")
-            
-            places = await search_places_nearby(client, location['lat'], location['lng'])
-            
-            for place in places:
-                place_id = place.get('place_id')
-                if place_id in seen_place_ids:
-                    continue
-                
-                seen_place_ids.add(place_id)
-                
-                # Get detailed information
-                details = await get_place_details(client, place_id)
-                if details:
-                    place.update(details)
-                    
-                    # Get images only if not disabled
-                    if not args.no_images:
-                        photos = details.get('photos', [])
-                        if photos:
-                            print(f"  📸 Found {len(photos)} photos for {place.get('name', 'Unknown')}")
-                            images = await get_place_images(client, place_id, photos, args.max_images)
-                            place['images'] = images
-                        else:
-                            place['images'] = []
-                    else:
-                        place['images'] = []
-                
-                # Enhance with description and offerings
-                enhanced_place = enhance_place_data_with_description(place)
-                all_places.append(enhanced_place)
-                print(f"  ✅ Found: {place.get('name', 'Unknown')}")
-            
-            # Be nice to the API
-            await asyncio.sleep(1)
+    checkpoint_places, completed_locations = load_checkpoint(CHECKPOINT_FILE)
+    if checkpoint_places or completed_locations:
+        log.info("♻️  Resuming from %s: %s shops, %s locations done", CHECKPOINT_FILE, len(checkpoint_places), len(completed_locations))
+    
+    seen_place_ids = {place.get('place_id') for place in checkpoint_places}
+    del checkpoint_places
+    sem = asyncio.Semaphore(SEARCH_CONCURRENCY)
+    
+    def process_place(place: Dict[str, Any]) -> None:
+        # Details come back with the search results; get images only if not disabled
+        if not args.no_images:
+            photos = place.get('photos', [])
+            if photos:
+                log.debug("  📸 Found %s photos for %s", len(photos), place.get('name', 'Unknown'))
+                place['images'] = get_place_images(photos, args.max_images)
+            else:
+                place['images'] = []
+        else:
+            place['images'] = []
+        
+        # Enhance with description and offerings
+        enhanced_place = enhance_place_data_with_description(place)
+        checkpoint.write(orjson.dumps(enhanced_place) + b"\n")
+        log.debug("  ✅ Found: %s", place.get('name', 'Unknown'))
+    
+    async def search_one(client: httpx.AsyncClient, location: Dict[str, Any]) -> None:
+        if location['name'] in completed_locations:
+            return
+        
+        log.debug("📍 Searching near %s...", location['name'])
+        async with sem:
+            places, complete = await search_places_nearby(client, location['lat'], location['lng'], cache=cache)
+        
+        # No await between check and add, so concurrent searches cannot both claim a place
+        for place in places:
+            place_id = place.get('place_id')
+            if place_id in seen_place_ids:
+                continue
+            seen_place_ids.add(place_id)
+            process_place(place)
+        # A failed search stays pending, so a resumed run searches it again
+        if complete:
+            checkpoint.write(orjson.dumps({"completed_location": location['name']}) + b"\n")
+        checkpoint.flush()
+    
+    search_locations = spread_search_locations(UK_LOCATIONS)
+    log.info("📍 Searching %s of %s locations (%s duplicate an earlier search)", len(search_locations), len(UK_LOCATIONS), len(UK_LOCATIONS) - len(search_locations))
+    
+    with open(CHECKPOINT_FILE, "ab") as checkpoint, open_places_cache(not args.no_cache) as cache:
+        async with create_client() as client:
+            await asyncio.gather(*(search_one(client, location) for location in search_locations))
+    all_places, completed_locations = load_checkpoint(CHECKPOINT_FILE)
+    failed_locations = [location['name'] for location in search_locations if location['name'] not in completed_locations]
+    unique_places = dedupe_nearby_places(all_places)
+    if len(unique_places) < len(all_places):
+        log.info("🧹 Dropped %s duplicate listings within %sm of a same-name shop", len(all_places) - len(unique_places), int(DUPLICATE_DISTANCE_KM * 1000))
+    all_places = unique_places
     
     # Count shops with images
     shops_with_images = sum(1 for place in all_places if place.get('images'))
-    print(f"\n📊 Found {len(all_places)} unique farm shops")
+    log.info("📊 Found %s unique farm shops", len(all_places))
     if not args.no_images:
-        print(f"📸 {shops_with_images} shops have images ({shops_with_images/len(all_places)*100:.1f}%)")
+        log.info("📸 %s shops have images (%.1f%%)", shops_with_images, shops_with_images/len(all_places)*100)
     
     # Convert to FarmShop models
-    shops = []
-    for place in all_places:
-        try:
-            name = place.get('name', 'Unknown Farm Shop')
-            
-            # Use address components if available, otherwise fallback to formatted address
-            if place.get('address_components'):
-                address_info = parse_address_components(place.get('address_components', []), place.get('formatted_address', ''))
-            else:
-                address_info = parse_address(place.get('formatted_address', ''))
-            
-            # Create location object
-            location = Location(
-                lat=place.get('geometry', {}).get('location', {}).get('lat', 0),
-                lng=place.get('geometry', {}).get('location', {}).get('lng', 0),
-                address=address_info.get('address', ''),
-                city=address_info.get('city', ''),
-                county=address_info.get('county', ''),
-                postcode=address_info.get('postcode', '')
-            )
-            
-            # Create contact object
-            contact = Contact(
-                phone=place.get('international_phone_number', ''),
-                email=None,  # Google Places doesn't provide email
-                website=place.get('website', '')
-            )
-            
-            # Create farm shop object
-            shop = FarmShop(
-                id=f"farm_{slugify(name)}",
-                name=name,
-                slug=slugify(name),
-                location=location,
-                contact=contact,
-                offerings=place.get('offerings', []),
-                images=place.get('images', []),
-                rating=place.get('rating'),
-                user_ratings_total=place.get('user_ratings_total'),
-                price_level=place.get('price_level'),
-                place_id=place.get('place_id'),
-                types=place.get('types', [])
-            )
-            
-            shops.append(shop)
-            
-        except Exception as e:
-            print(f"❌ Error processing {place.get('name', 'Unknown')}: {e}")
-            continue
+    shops = build_farm_shops(all_places)
     
     # Save to JSON files
-    output_dir = Path("dist")
-    output_dir.mkdir(exist_ok=True)
-    
     # Save as JSON
-    with open(output_dir / "farms.uk.json", "w", encoding="utf-8") as f:
-        json.dump([shop.dict() for shop in shops], f, indent=2, ensure_ascii=False)
+    with open(output_dir / "farms.uk.json", "wb") as f:
+        f.write(orjson.dumps([shop.model_dump() for shop in shops], option=orjson.OPT_INDENT_2))
     
     # Save as GeoJSON for mapping
     geojson = {
@@ -394,55 +628,64 @@ async def main():
         }
         geojson["features"].append(feature)
     
-    with open(output_dir / "farms.geo.json", "w", encoding="utf-8") as f:
-        json.dump(geojson, f, indent=2, ensure_ascii=False)
+    with open(output_dir / "farms.geo.json", "wb") as f:
+        f.write(orjson.dumps(geojson, option=orjson.OPT_INDENT_2))
     
-    print(f"✅ Saved {len(shops)} farm shops to dist/farms.uk.json and dist/farms.geo.json")
+    log.info("✅ Saved %s farm shops to dist/farms.uk.json and dist/farms.geo.json", len(shops))
+    
+    if failed_locations:
+        # Keep the checkpoint so the next run only retries the failed searches
+        log.warning("⚠️  %s searches failed (%s); re-run to retry them", len(failed_locations), ", ".join(failed_locations))
+    else:
+        # Outputs are complete, so the next run starts a fresh search
+        CHECKPOINT_FILE.unlink()
 
-async def fetch_images_only(max_images: int = 1):
+async def fetch_images_only(max_images: int = 1, use_cache: bool = True):
     """Fetch only images for existing farms."""
-    print("📸 Fetching images for existing farms...")
+    log.info("📸 Fetching images for existing farms...")
     
     # Load existing farms
     try:
-        with open("dist/farms.uk.json", "r", encoding="utf-8") as f:
-            farms_data = json.load(f)
+        with open("dist/farms.uk.json", "rb") as f:
+            farms_data = orjson.loads(f.read())
     except FileNotFoundError:
-        print("❌ farms.uk.json not found. Run the main script first.")
+        log.error("❌ farms.uk.json not found. Run the main script first.")
         return
     
-    updated_farms = []
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for i, farm in enumerate(farms_data):
-            print(f"📸 Processing {i+1}/{len(farms_data)}: {farm['name']}")
+    sem = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    total = len(farms_data)
+    
+    async def process_farm(client: httpx.AsyncClient, i: int, farm: Dict[str, Any]) -> None:
+        async with sem:
+            log.debug("📸 Processing %s/%s: %s", i+1, total, farm['name'])
             
             place_id = farm.get('place_id')
             if not place_id:
-                print(f"  ⚠️  No place_id for {farm['name']}, skipping")
-                updated_farms.append(farm)
-                continue
+                log.debug("  ⚠️  No place_id for %s, skipping", farm['name'])
+                return
             
             # Get place details to check for photos
-            details = await get_place_details(client, place_id)
-            if details and details.get('photos'):
-                photos = details['photos']
-                print(f"  📸 Found {len(photos)} photos")
-                images = await get_place_images(client, place_id, photos, max_images)
-                farm['images'] = images
+            details = await get_place_details(client, place_id, cache=cache)
+            photos = details.get('photos', []) if details else []
+            if photos:
+                log.debug("  📸 Found %s photos", len(photos))
+                farm['images'] = get_place_images(photos, max_images)
             else:
                 farm['images'] = []
-                print(f"  📸 No photos found")
-            
-            updated_farms.append(farm)
-            
-            # Be nice to the API
-            await asyncio.sleep(1)
+                log.debug("  📸 No photos found")
+    
+    with open_places_cache(use_cache) as cache:
+        async with create_client() as client:
+            await asyncio.gather(*(process_farm(client, i, farm) for i, farm in enumerate(farms_data)))
+    
+    # Farms are updated in place, order is preserved
+    updated_farms = farms_data
     
     # Save updated farms
-    with open("dist/farms.uk.json", "w", encoding="utf-8") as f:
-        json.dump(updated_farms, f, indent=2, ensure_ascii=False)
+    with open("dist/farms.uk.json", "wb") as f:
+        f.write(orjson.dumps(updated_farms, option=orjson.OPT_INDENT_2))
     
-    print(f"✅ Updated {len(updated_farms)} farms with images")
+    log.info("✅ Updated %s farms with images", len(updated_farms))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
@@ -6,7 +6,7 @@ import random, string
 
 def _rand_id() -> str:
     alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789'
-    return 'farm_' + ''.join(random.choice(alphabet) for _ in range(10))
+    return 'farm_' + ''.join(random.choices(alphabet, k=10))
 
 class Location(BaseModel):
     lat: Optional[float] = None
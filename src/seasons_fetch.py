@@ -1,5 +1,6 @@
 from __future__ import annotations
-import os, sys, json
+import os, sys
+import orjson
 from pathlib import Path
 from datetime import datetime, timezone
 from typing import List, TypedDict
@@ -28,15 +29,17 @@ def find_sample() -> Path | None:
             return p
     return None
 
-def load_local() -> List[SeasonItem]:
+def require_sample() -> Path:
     sample = find_sample()
     if not sample:
         print("❌ Sample file missing; looked in:", file=sys.stderr)
         for p in SCHEMA_SAMPLE_CANDIDATES:
             print(f"  - {p}", file=sys.stderr)
         sys.exit(1)
+    return sample
 
-    data = json.loads(sample.read_text("utf-8"))
+def load_local(sample: Path) -> List[SeasonItem]:
+    data = orjson.loads(sample.read_bytes())
     now = datetime.now(timezone.utc).isoformat()
     for d in data:
         d.setdefault("source", "https://example.org/sample")
@@ -46,8 +49,14 @@ def load_local() -> List[SeasonItem]:
 
 def main():
     provider = os.getenv("SEASON_PROVIDER", "local").lower()
+    out = DIST / "seasons.uk.json"
     if provider == "local":
-        items = load_local()
+        sample = require_sample()
+        # Output written after the last sample change is already up to date
+        if out.exists() and out.stat().st_mtime >= sample.stat().st_mtime:
+            print(f"✅ {out} is up to date with {sample}")
+            return
+        items = load_local(sample)
     elif provider == "eufic":
         # Implemented next step
         print("EUFIC provider not yet implemented. Use SEASON_PROVIDER=local for now.", file=sys.stderr)
@@ -57,8 +66,7 @@ def main():
         sys.exit(2)
 
     DIST.mkdir(parents=True, exist_ok=True)
-    out = DIST / "seasons.uk.json"
-    out.write_text(json.dumps(items, ensure_ascii=False, indent=2))
+    out.write_bytes(orjson.dumps(items, option=orjson.OPT_INDENT_2))
     print(f"✅ Wrote {len(items)} seasonal items → {out}")
 
 if __name__ == "__main__":
@@ -10,6 +10,10 @@ import sys, json, pathlib
 from typing import List, Dict, Any
 
 import yaml  # provided by crawl4ai
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
 from crawl4ai import AsyncWebCrawler, BrowserConfig
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
@@ -19,7 +23,7 @@ def load_seeds() -> Dict[str, Any]:
     if not SEEDS_FILE.exists():
         raise SystemExit(f"Missing seeds file: {SEEDS_FILE}")
     with open(SEEDS_FILE, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
+        return yaml.load(f, Loader=SafeLoader) or {}
 
 async def boot_test():
     seeds = load_seeds()
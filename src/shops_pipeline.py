@@ -1,18 +1,32 @@
 from __future__ import annotations
-import asyncio, json, os, re, sys, time, pathlib
+import asyncio, json, os, re, shelve, sys, time, pathlib
+from collections import defaultdict
 from typing import Any, Dict, List, Optional, Tuple
 import orjson, httpx, yaml
-from bs4 import BeautifulSoup
-from jsonschema import validate
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+from aiolimiter import AsyncLimiter
+from bs4 import BeautifulSoup, SoupStrainer
+import soupsieve  # ships with beautifulsoup4
+try:
+    import lxml  # noqa: F401  (C-backed parser for BeautifulSoup)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+from jsonschema.validators import validator_for
 from crawl4ai import CrawlerHub, BrowserConfig
-from pydantic import ValidationError
+from pydantic import TypeAdapter, ValidationError
 from models import FarmShop, Location, Contact
 from utils_geo import slugify, haversine_km, geohash
+from utils_http import create_client
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 SEEDS = ROOT / "seeds" / "uk.yml"
 DIST = ROOT / "dist"
 DIST.mkdir(parents=True, exist_ok=True)
+FARM_SHOPS = TypeAdapter(List[FarmShop])
 
 SCHEMA_URL = os.getenv(
     "FARM_SCHEMA_URL",
@@ -22,43 +36,80 @@ SCHEMA_URL = os.getenv(
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
 NOMINATIM_UA = os.getenv("NOMINATIM_UA", "FarmCompanionBot/1.0 (+https://www.farmcompanion.co.uk/contact)")
 NOMINATIM_EMAIL = os.getenv("NOMINATIM_EMAIL")  # optional & recommended
+NOMINATIM_RPS = float(os.getenv("NOMINATIM_RPS", "1"))  # public instance policy: max 1 rps; lower to go slower, raise for self-hosted
+NOMINATIM_CONCURRENCY = int(os.getenv("NOMINATIM_CONCURRENCY", "1"))  # requests in flight; public policy: a single connection
+GEOCODE_CACHE_FILE = DIST / ".geocode_cache"
+SCHEMA_CACHE_FILE = DIST / ".schema_cache"
+GEOCODE_MISS_TTL = 7 * 24 * 3600  # retry addresses Nominatim couldn't resolve after a week
 
 NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9 '&.-]+")
 PC_RE = re.compile(r"[A-Za-z]{1,2}\d[A-Za-z\d]?\s*\d[A-Za-z]{2}", re.I)  # UK postcode
+DEDUPE_CELLS_PER_DEG = 200  # 0.005° grid cells, wider than the 0.25 km merge radius even in longitude at UK latitudes
+SIMPLE_SELECTOR_RE = re.compile(r"^(?=[A-Za-z.])([A-Za-z][\w-]*)?(?:\.([\w-]+))?$")  # "tag", ".class" or "tag.class"
 
 def load_seeds() -> Dict[str, Any]:
     if not SEEDS.exists():
         raise SystemExit(f"Missing seeds file: {SEEDS}")
     with open(SEEDS, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
+        return yaml.load(f, Loader=SafeLoader) or {}
 
-async def fetch_schema() -> Dict[str, Any]:
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(SCHEMA_URL)
+async def fetch_schema(client: httpx.AsyncClient) -> Dict[str, Any]:
+    # Conditional GET: reuse the cached schema body while its ETag still matches
+    with shelve.open(str(SCHEMA_CACHE_FILE)) as cache:
+        cached = cache.get(SCHEMA_URL)  # (etag, body)
+        headers = {"If-None-Match": cached[0]} if cached else None
+        r = await client.get(SCHEMA_URL, headers=headers)
+        if r.status_code == 304 and cached:
+            return orjson.loads(cached[1])
         r.raise_for_status()
-        return r.json()
+        etag = r.headers.get("etag")
+        if etag:
+            cache[SCHEMA_URL] = (etag, r.content)
+        return orjson.loads(r.content)
 
-async def geocode_missing(shops: List[FarmShop]) -> None:
-    async with httpx.AsyncClient(timeout=30, headers={"User-Agent": NOMINATIM_UA}) as client:
-        for s in shops:
-            if s.location.lat is not None and s.location.lng is not None:
-                continue
+async def geocode_missing(shops: List[FarmShop], client: httpx.AsyncClient) -> None:
+    # At most one request start every 1/NOMINATIM_RPS seconds
+    limiter = AsyncLimiter(max_rate=1, time_period=1 / NOMINATIM_RPS)
+    # The limiter only paces starts; the semaphore bounds requests in flight when Nominatim is slow
+    sem = asyncio.Semaphore(NOMINATIM_CONCURRENCY)
+    # Shops sharing a query share one lookup: key -> (query, shops)
+    pending: Dict[str, Tuple[str, List[FarmShop]]] = {}
+    for s in shops:
+        if s.location.lat is None or s.location.lng is None:
             q = " ".join([s.location.address, s.location.postcode or "", "United Kingdom"]).strip()
-            params = {"format":"jsonv2","q":q,"countrycodes":"gb","limit":"1","addressdetails":"0"}
-            if NOMINATIM_EMAIL: params["email"] = NOMINATIM_EMAIL
-            try:
-                resp = await client.get(NOMINATIM_URL, params=params)
-                data = resp.json()
-                if isinstance(data, list) and data:
-                    s.location.lat = float(data[0]["lat"])
-                    s.location.lng = float(data[0]["lon"])
-            except Exception as e:
-                print(f"geocode fail for {s.name}: {e}", file=sys.stderr)
-            await asyncio.sleep(1.05)  # 1 rps polite
+            pending.setdefault(" ".join(q.lower().split()), (q, []))[1].append(s)
+    with shelve.open(str(GEOCODE_CACHE_FILE)) as cache:
+        async def geocode_one(key: str, q: str, group: List[FarmShop]) -> None:
+            entry = cache.get(key)  # (fetched_at, (lat, lng) or None for a miss)
+            if entry and (entry[1] is not None or time.time() - entry[0] < GEOCODE_MISS_TTL):
+                coords = entry[1]
+            else:
+                params = {"format":"jsonv2","q":q,"countrycodes":"gb","limit":"1","addressdetails":"0"}
+                if NOMINATIM_EMAIL: params["email"] = NOMINATIM_EMAIL
+                try:
+                    async with sem, limiter:
+                        resp = await client.get(NOMINATIM_URL, params=params)
+                    resp.raise_for_status()
+                    data = orjson.loads(resp.content)
+                    coords = (float(data[0]["lat"]), float(data[0]["lon"])) if isinstance(data, list) and data else None
+                except Exception as e:
+                    print(f"geocode fail for {', '.join(s.name for s in group)}: {e}", file=sys.stderr)
+                    return
+                cache[key] = (time.time(), coords)
+            if coords is not None:
+                for s in group:
+                    s.location.lat, s.location.lng = coords
+
+        await asyncio.gather(*(geocode_one(key, q, group) for key, (q, group) in pending.items()))
 
 def normalize_whitespace(s: str) -> str:
     return " ".join((s or "").split())
 
+def select_text(node, selector) -> str:
+    """Whitespace-normalised text of the first match of a compiled selector, or ""."""
+    el = selector.select_one(node) if selector is not None else None
+    return normalize_whitespace(el.get_text(strip=True)) if el is not None else ""
+
 def parse_items_from_html(html: str, hints: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Generic parser using hints from seeds (CSS selectors). This is intentionally simple.
@@ -66,28 +117,44 @@ def parse_items_from_html(html: str, hints: Dict[str, Any]) -> List[Dict[str, An
       list_selector: ".item"
       name_selector, addr_selector, pc_selector, county_selector, link_selector, phone_selector, email_selector, website_selector
     """
-    soup = BeautifulSoup(html, "html.parser")
+    list_selector = hints.get("list_selector", "").strip()
+    simple = SIMPLE_SELECTOR_RE.match(list_selector)
+    if simple:
+        # Only build the matching subtrees instead of the whole page
+        tag, cls = simple.groups()
+        match = {"name": tag.lower()} if tag else {}
+        strain = dict(match)
+        if cls:
+            match["class_"] = cls
+            # While parsing, class is still the raw "a b c" string, so match one word of it
+            strain["class_"] = re.compile(rf"(?:^|\s){re.escape(cls)}(?:\s|$)")
+        soup = BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer(**strain))
+        nodes = soup.find_all(**match)
+    else:
+        soup = BeautifulSoup(html, HTML_PARSER)
+        nodes = soup.select(list_selector) or []
+    # Compile each field selector once per page rather than once per node
+    name_sel, addr_sel, county_sel, pc_sel, phone_sel, email_sel, website_sel, link_sel = (
+        soupsieve.compile(hints[k]) if hints.get(k) else None
+        for k in ("name_selector", "addr_selector", "county_selector", "pc_selector",
+                  "phone_selector", "email_selector", "website_selector", "link_selector"))
+    if website_sel is not None:
+        link_sel = website_sel
     items = []
-    nodes = soup.select(hints.get("list_selector", "")) or []
     for n in nodes:
-        get = lambda sel: normalize_whitespace((n.select_one(sel).get_text(strip=True) if sel and n.select_one(sel) else ""))
-        name = get(hints.get("name_selector"))
-        addr = get(hints.get("addr_selector"))
-        county = get(hints.get("county_selector"))
-        pc = get(hints.get("pc_selector"))
+        name = select_text(n, name_sel)
+        addr = select_text(n, addr_sel)
+        county = select_text(n, county_sel)
+        pc = select_text(n, pc_sel)
         if not pc:
             m = PC_RE.search(n.get_text(" ", strip=True))
             pc = m.group(0) if m else ""
-        phone = get(hints.get("phone_selector"))
-        email = get(hints.get("email_selector"))
+        phone = select_text(n, phone_sel)
+        email = select_text(n, email_sel)
         website = ""
-        if hints.get("website_selector"):
-            a = n.select_one(hints["website_selector"])
-            if a and a.has_attr("href"):
-                website = a["href"]
-        elif hints.get("link_selector"):
-            a = n.select_one(hints["link_selector"])
-            if a and a.has_attr("href"): website = a["href"]
+        a = link_sel.select_one(n) if link_sel is not None else None
+        if a is not None and a.has_attr("href"):
+            website = a["href"]
         if not NAME_RE.search(name or "") and not pc:
             continue
         items.append({
@@ -123,35 +190,40 @@ def map_to_shops(raw: List[Dict[str, Any]]) -> List[FarmShop]:
         shops.append(fs)
     return shops
 
+def _richness(x: FarmShop) -> int:
+    """How many of coords, website and email a shop has populated."""
+    return int(bool(x.location.lat)) + int(bool(x.contact.website)) + int(bool(x.contact.email))
+
 def dedupe_shops(shops: List[FarmShop]) -> List[FarmShop]:
     # First pass: name+postcode key
-    seen: Dict[str, FarmShop] = {}
+    groups: Dict[str, List[FarmShop]] = defaultdict(list)
     for s in shops:
-        k = s.key_name_postcode()
-        if k not in seen:
-            seen[k] = s
-        else:
-            # prefer the one with coords or website/email populated
-            a, b = seen[k], s
-            score = lambda x: int(bool(x.location.lat)) + int(bool(x.contact.website)) + int(bool(x.contact.email))
-            if score(b) > score(a):
-                seen[k] = b
-    deduped = list(seen.values())
+        groups[s.key_name_postcode()].append(s)
+    # prefer the one with coords or website/email populated (max keeps the first on ties)
+    deduped = [max(g, key=_richness) for g in groups.values()]
 
     # Second pass: proximity within 0.25 km with same name (ignoring postcode)
-    deduped.sort(key=lambda s: (s.name.lower(), s.location.postcode))
+    # (name_lower, postcode, lat, lng, shop) read once per shop instead of in every comparison
+    views = sorted(((s.name.lower(), s.location.postcode, s.location.lat, s.location.lng, s) for s in deduped),
+                   key=lambda v: v[:2])
     result: List[FarmShop] = []
-    for s in deduped:
+    # Only same-name shops in the same or a neighbouring ~500 m grid cell can be within 0.25 km
+    grid: Dict[Tuple[str, int, int], List[Tuple[int, float, float, FarmShop]]] = defaultdict(list)
+    for nm, _, lat, lng, s in views:
         merged = False
-        for r in result:
-            if r.name.lower() == s.name.lower() and r.location.lat and r.location.lng and s.location.lat and s.location.lng:
-                if haversine_km(r.location.lat, r.location.lng, s.location.lat, s.location.lng) < 0.25:
-                    merged = True
-                    # keep richer contact
-                    if (s.contact.website and not r.contact.website): r.contact.website = s.contact.website
-                    if (s.contact.email and not r.contact.email): r.contact.email = s.contact.email
-                    if (s.contact.phone and not r.contact.phone): r.contact.phone = s.contact.phone
-                    break
+        if lat and lng:
+            cx, cy = int(lat * DEDUPE_CELLS_PER_DEG), int(lng * DEDUPE_CELLS_PER_DEG)
+            near = [c for dx in (-1, 0, 1) for dy in (-1, 0, 1) for c in grid.get((nm, cx + dx, cy + dy), ())
+                    if haversine_km(c[1], c[2], lat, lng) < 0.25]
+            if near:
+                merged = True
+                r = min(near, key=lambda c: c[0])[3]  # earliest kept shop, as the linear scan chose
+                # keep richer contact
+                if (s.contact.website and not r.contact.website): r.contact.website = s.contact.website
+                if (s.contact.email and not r.contact.email): r.contact.email = s.contact.email
+                if (s.contact.phone and not r.contact.phone): r.contact.phone = s.contact.phone
+            else:
+                grid[(nm, cx, cy)].append((len(result), lat, lng, s))
         if not merged:
             result.append(s)
     return result
@@ -178,27 +250,36 @@ def to_geojson(shops: List[FarmShop]) -> Dict[str, Any]:
     return {"type":"FeatureCollection","features":feats}
 
 async def main():
+    if NOMINATIM_RPS <= 0:
+        raise SystemExit(f"NOMINATIM_RPS must be positive, got {NOMINATIM_RPS}")
+    if NOMINATIM_CONCURRENCY < 1:
+        raise SystemExit(f"NOMINATIM_CONCURRENCY must be at least 1, got {NOMINATIM_CONCURRENCY}")
     seeds = load_seeds()
     raw = await crawl_sources(seeds)
     print(f"🔎 parsed items: {len(raw)}")
     shops = map_to_shops(raw)
     print(f"🗺️ mapped shops: {len(shops)}")
 
-    # Geocode missing coords
-    await geocode_missing(shops)
+    async with create_client(headers={"User-Agent": NOMINATIM_UA}) as client:
+        # Geocode missing coords
+        await geocode_missing(shops, client)
+
+        # Deduplicate
+        shops = dedupe_shops(shops)
+        print(f"🧹 deduped shops: {len(shops)}")
 
-    # Deduplicate
-    shops = dedupe_shops(shops)
-    print(f"🧹 deduped shops: {len(shops)}")
+        # Validate against farm-schema
+        schema = await fetch_schema(client)
 
-    # Validate against farm-schema
-    schema = await fetch_schema()
-    data = [s.model_dump() for s in shops]
-    # validate each item (lightweight loop to pinpoint errors)
+    data = FARM_SHOPS.dump_python(shops)
+    # Check the schema and build its validator once, then validate each item (to pinpoint errors)
+    validator_cls = validator_for(schema)
+    validator_cls.check_schema(schema)
+    validator = validator_cls(schema)
     ok = 0
     for i, item in enumerate(data):
         try:
-            validate(item, schema)
+            validator.validate(item)
             ok += 1
         except Exception as e:
             print(f"❌ schema error at index {i}: {e}", file=sys.stderr)
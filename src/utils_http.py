@@ -0,0 +1,14 @@
+from __future__ import annotations
+import httpx
+
+def create_client(**kwargs) -> httpx.AsyncClient:
+    """Create an HTTP/2 client with the pipelines' shared timeout and connection limits.
+
+    Extra keyword arguments (headers, follow_redirects, ...) are passed through to httpx.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=25, keepalive_expiry=30.0),
+        **kwargs,
+    )
@@ -0,0 +1,19 @@
+from __future__ import annotations
+import os, shutil, tempfile
+from pathlib import Path
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    """Write data to path via a temp file + rename, so a crash never leaves a partial file"""
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix=f".{path.name}.", delete=False) as tmp:
+        try:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    # NamedTemporaryFile is created 0600; keep the permissions of the file being replaced
+    if path.exists():
+        shutil.copymode(path, tmp.name)
+    os.replace(tmp.name, path)
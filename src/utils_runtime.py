@@ -0,0 +1,43 @@
+from __future__ import annotations
+import asyncio, logging, os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Coroutine, List, Optional, Sequence, TypeVar
+try:
+    import uvloop
+except ImportError:  # optional; not available on Windows
+    uvloop = None
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Above this many items, map_chunked spreads the work across a process pool
+PARALLEL_THRESHOLD = 10_000
+
+def run(main: Coroutine[Any, Any, Any]) -> Any:
+    """Run an entry-point coroutine on uvloop when it is installed, else the stdlib loop."""
+    if uvloop:
+        return uvloop.run(main)
+    return asyncio.run(main)
+
+def setup_logging(verbose: bool = False) -> None:
+    """Log plain messages at INFO, or DEBUG with --verbose."""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO, format="%(message)s")
+    # httpx logs every request at INFO; only show those when debugging
+    logging.getLogger("httpx").setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+def _map_chunk(fn: Callable[[T], Optional[R]], items: Sequence[T]) -> List[R]:
+    """Apply fn to one slice of items, dropping None results (runs in a worker process)."""
+    return [r for r in map(fn, items) if r is not None]
+
+def map_chunked(fn: Callable[[T], Optional[R]], items: Sequence[T], threshold: int = PARALLEL_THRESHOLD) -> List[R]:
+    """Apply a module-level fn to every item, in input order, across processes for large inputs."""
+    if len(items) <= threshold:
+        return _map_chunk(fn, items)
+    
+    # Contiguous chunks, one per worker, so the output keeps the input order
+    workers = os.cpu_count() or 1
+    size = -(-len(items) // workers)
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return [r for results in ex.map(partial(_map_chunk, fn), chunks) for r in results]